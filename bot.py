@@ -1,17 +1,33 @@
 import os
 import logging
 import asyncio
+import ssl
 import aiohttp
 import aiofiles
+import aiofiles.tempfile
+from cachetools import TTLCache
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from telegram import Update
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
+from telegram.ext import AIORateLimiter, Application, CommandHandler, MessageHandler, filters, ContextTypes
 from telegram.constants import ParseMode
+from telegram.error import BadRequest, RetryAfter, TelegramError
 import time
+from datetime import date
 
 # Import our downloader
 from terabox_downloader import TeraboxDownloader
+from config import (
+    BOT_TOKEN,
+    DOWNLOAD_BURST,
+    DOWNLOAD_COOLDOWN,
+    DOWNLOAD_PATH,
+    LOCAL_BOT_API_URL,
+    MAX_CONCURRENT_DOWNLOADS,
+    MAX_CONCURRENT_LOOKUPS,
+    MAX_DOWNLOADS_PER_DAY,
+)
 
 # Setup logging
 logging.basicConfig(
@@ -20,12 +36,66 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Your bot token
-BOT_TOKEN = "8546123786:AAFHdnlAYk2qu8lIr--yXmdJlELDWOQ-KRM"
-
 # Create downloader instance
 downloader = TeraboxDownloader()
 
+# Shared HTTP session (created in post_init, closed in post_shutdown)
+SESSION = None
+
+# TLS settings and CA certificates are loaded once for every connection
+_SSL_CTX = ssl.create_default_context()
+
+# Link metadata caches (direct download URLs expire sooner)
+INFO_CACHE = TTLCache(maxsize=4096, ttl=600)
+DL_CACHE = TTLCache(maxsize=4096, ttl=120)
+
+# Metadata lookups in progress, keyed by (kind, url)
+PENDING = {}
+
+# Page scraping gets its own threads, so a burst of queued links can't
+# starve the default executor that the downloads write files through
+LOOKUP_EXECUTOR = ThreadPoolExecutor(MAX_CONCURRENT_LOOKUPS, thread_name_prefix='lookup')
+
+# Concurrent download slots, shared by all users
+DOWNLOAD_SEM = asyncio.Semaphore(MAX_CONCURRENT_DOWNLOADS)
+queued_links = 0
+
+# Per-user limits: user id -> (day, downloads that day, recent start times).
+# Bounded, and entries expire once they can no longer affect today's limits.
+USER_LIMITS = TTLCache(maxsize=10_000, ttl=24 * 60 * 60)
+
+# Parallel range download settings
+RANGE_SEGMENTS = 8
+MIN_RANGE_SIZE = 8 * 1024 * 1024  # Smaller files use a single stream
+
+# Download tuning
+WRITE_BATCH_SIZE = 1024 * 1024  # bytes collected per disk write
+DOWNLOAD_RETRIES = 4  # resume attempts after a dropped connection
+PROGRESS_INTERVAL = 3  # seconds between progress edits
+
+# Progress message, filled in with (filename, percent, MB downloaded)
+_PROGRESS_TMPL = (
+    "⬇️ <b>Downloading file...</b>\n\n"
+    "📁 <b>File:</b> <code>%s</code>\n"
+    "📊 <b>Progress:</b> %.1f%%\n"
+    "⏳ <b>Downloaded:</b> %.1f MB"
+)
+
+# Largest upload the cloud Bot API accepts; downloads up to it stay in memory
+CLOUD_UPLOAD_LIMIT = 50 * 1024 * 1024
+MAX_MEMORY_DOWNLOAD = CLOUD_UPLOAD_LIMIT
+
+class FileTooLarge(Exception):
+    """The file is bigger than Telegram would accept from the bot."""
+    
+    def __init__(self, size):
+        super().__init__(f"File is {size} bytes")
+        self.size = size
+
+def too_large_to_send(size):
+    """Whether a file of this size can't be uploaded through the cloud Bot API."""
+    return size > CLOUD_UPLOAD_LIMIT and not LOCAL_BOT_API_URL
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Send a message when the command /start is issued."""
     user = update.effective_user
@@ -79,8 +149,106 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             parse_mode=ParseMode.HTML
         )
 
+async def run_once(key, func, *args):
+    """Run func(*args) in a lookup thread; concurrent callers with the same key share one call."""
+    task = PENDING.get(key)
+    if task is None:
+        loop = asyncio.get_running_loop()
+        task = asyncio.ensure_future(loop.run_in_executor(LOOKUP_EXECUTOR, func, *args))
+        PENDING[key] = task
+        task.add_done_callback(lambda _: PENDING.pop(key, None))
+    
+    # A cancelled caller must not cancel the lookup for everyone else
+    return await asyncio.shield(task)
+
+async def get_file_info(url):
+    """Return (file info, fresh) for the link, using the cache when possible.
+    
+    fresh is False when the info came from the cache.
+    """
+    key = downloader.share_key(url)
+    file_info = INFO_CACHE.get(key)
+    if file_info is not None:
+        return file_info, False
+    
+    # Scraping is blocking, keep it off the event loop
+    file_info = await run_once(('info', key), downloader.extract_info, url)
+    if file_info:
+        INFO_CACHE[key] = file_info
+    return file_info, True
+
+async def get_download_info(url, file_info, fresh):
+    """Return direct download info for the link, using the cache when possible.
+    
+    A fresh file_info is reused so the page isn't fetched again. A cached one
+    may hold a direct link that has expired since, so the page is re-read.
+    """
+    key = downloader.share_key(url)
+    download_info = DL_CACHE.get(key)
+    if download_info is None:
+        if not fresh and 'direct_url' in file_info:
+            file_info = None
+        download_info = await run_once(
+            ('download', key), downloader.get_direct_download, url, file_info
+        )
+        if download_info:
+            DL_CACHE[key] = download_info
+    return download_info
+
+def forget_link(url):
+    """Drop the cached lookups for a link, e.g. after its download failed."""
+    key = downloader.share_key(url)
+    INFO_CACHE.pop(key, None)
+    DL_CACHE.pop(key, None)
+
+def check_user_limit(user_id):
+    """Record a download for the user, or return a message if it isn't allowed.
+    
+    Call refund_user() if the link then turns out not to be downloadable.
+    """
+    now = time.monotonic()
+    today = date.today()
+    day, count, starts = USER_LIMITS.get(user_id, (today, 0, ()))
+    if day != today:
+        count = 0
+    
+    if count >= MAX_DOWNLOADS_PER_DAY:
+        return (
+            f"🚫 <b>Daily limit reached!</b>\n\n"
+            f"You can download up to {MAX_DOWNLOADS_PER_DAY} files per day.\n"
+            f"Please try again tomorrow."
+        )
+    
+    # Up to DOWNLOAD_BURST downloads in any DOWNLOAD_COOLDOWN window
+    starts = tuple(start for start in starts if now - start < DOWNLOAD_COOLDOWN)
+    if len(starts) >= DOWNLOAD_BURST:
+        wait = int(DOWNLOAD_COOLDOWN - (now - starts[0])) + 1
+        return (
+            f"⏳ <b>Please slow down!</b>\n\n"
+            f"Wait {wait} seconds before sending another link."
+        )
+    
+    USER_LIMITS[user_id] = (today, count + 1, starts + (now,))
+    return None
+
+def refund_user(user_id):
+    """Give back a download recorded by check_user_limit() that never happened."""
+    entry = USER_LIMITS.get(user_id)
+    if entry is not None:
+        day, count, starts = entry
+        USER_LIMITS[user_id] = (day, max(count - 1, 0), starts[:-1])
+
 async def process_terabox_link(update: Update, url: str):
     """Process Terabox link and download file."""
+    global queued_links
+    
+    # Enforce per-user limits
+    user_id = update.effective_user.id
+    limit_error = check_user_limit(user_id)
+    if limit_error:
+        await update.message.reply_text(limit_error, parse_mode=ParseMode.HTML)
+        return
+    
     # Send processing message
     processing_msg = await update.message.reply_text(
         "🔍 <b>Processing your Terabox link...</b>\n"
@@ -88,12 +256,51 @@ async def process_terabox_link(update: Update, url: str):
         parse_mode=ParseMode.HTML
     )
     
+    # Look the link up right away so it overlaps with waiting for a slot
+    looked_up = time.monotonic()
+    info_task = asyncio.ensure_future(get_file_info(url))
+    
+    # Wait for a free download slot
+    queued = DOWNLOAD_SEM.locked()
+    try:
+        if queued:
+            queued_links += 1
+            try:
+                await safe_edit(
+                    processing_msg,
+                    f"⏳ <b>All download slots are busy</b>\n\n"
+                    f"📋 <b>Queue position:</b> {queued_links}\n"
+                    f"Your link will be processed shortly...",
+                    parse_mode=ParseMode.HTML
+                )
+                await DOWNLOAD_SEM.acquire()
+            finally:
+                queued_links -= 1
+        else:
+            await DOWNLOAD_SEM.acquire()
+    except BaseException:
+        info_task.cancel()
+        refund_user(user_id)
+        raise
+    
     try:
+        if queued:
+            await safe_edit(
+                processing_msg,
+                "🔍 <b>Processing your Terabox link...</b>\n"
+                "⏳ Please wait while I analyze the file...",
+                parse_mode=ParseMode.HTML
+            )
+        
         # Extract file information
-        file_info = downloader.extract_info(url)
+        file_info, fresh = await info_task
+        # A direct link found before a long wait in the queue may have expired
+        if time.monotonic() - looked_up > DL_CACHE.ttl:
+            fresh = False
         
         if not file_info:
-            await processing_msg.edit_text(
+            await safe_edit(
+                processing_msg,
                 "❌ <b>Failed to process link!</b>\n\n"
                 "Possible reasons:\n"
                 "• Link is private/restricted\n"
@@ -102,114 +309,496 @@ async def process_terabox_link(update: Update, url: str):
                 "Please check the link and try again.",
                 parse_mode=ParseMode.HTML
             )
+            refund_user(user_id)
             return
         
         # Get filename
         filename = file_info.get('filename', f'terabox_file_{int(time.time())}')
         
         # Try to get direct download
-        download_info = downloader.get_direct_download(url)
+        download_info = await get_download_info(url, file_info, fresh)
         
         if download_info and 'url' in download_info:
-            # We have a direct download URL
-            await start_download(update, processing_msg, download_info, filename)
+            # We have a direct download URL; a dead one shouldn't be retried from the cache
+            downloaded = await start_download(update, processing_msg, download_info, filename)
+            if downloaded is False:
+                forget_link(url)
+            if not downloaded:
+                refund_user(user_id)
         else:
             # No direct download available, show manual method
             await show_manual_method(update, processing_msg, url, filename, file_info)
+            refund_user(user_id)
             
     except Exception as e:
         logger.error(f"Error processing link: {str(e)}")
-        await processing_msg.edit_text(
+        refund_user(user_id)
+        await safe_edit(
+            processing_msg,
             f"❌ <b>Error occurred!</b>\n\n"
             f"Error: {str(e)[:100]}\n\n"
             f"Please try again later.",
             parse_mode=ParseMode.HTML
         )
+    finally:
+        DOWNLOAD_SEM.release()
+
+async def safe_edit(message, text, **kwargs):
+    """Edit a status message, waiting out Telegram flood control."""
+    try:
+        return await message.edit_text(text, **kwargs)
+    except RetryAfter as e:
+        logger.warning(f"Flood control exceeded, retrying edit in {e.retry_after}s")
+        await asyncio.sleep(e.retry_after)
+        return await message.edit_text(text, **kwargs)
+    except BadRequest as e:
+        # Usually "message is not modified", nothing to do
+        logger.debug(f"Edit skipped: {str(e)}")
+
+async def edit_progress(processing_msg, filename, downloaded, total_size):
+    """Show download progress in the processing message."""
+    progress = (downloaded / total_size) * 100
+    try:
+        await safe_edit(
+            processing_msg,
+            _PROGRESS_TMPL % (filename, progress, downloaded / 1048576.0),
+            parse_mode=ParseMode.HTML
+        )
+    except TelegramError as e:
+        # Progress is best effort, never let it stop the download
+        logger.warning(f"Progress update failed: {str(e)}")
+
+async def probe_range_support(session, url):
+    """Return the file size if the server honours byte ranges, otherwise 0."""
+    async with session.get(url, headers={"Range": "bytes=0-0"}) as response:
+        if response.status != 206:
+            return 0
+        
+        # Content-Range looks like "bytes 0-0/12345"
+        total = response.headers.get('content-range', '').rpartition('/')[2]
+        return int(total) if total.isdigit() else 0
+
+def _pwrite_all(fd, data, offset):
+    """os.pwrite until all of data is written at offset."""
+    view = memoryview(data)
+    while view:
+        written = os.pwrite(fd, view, offset)
+        if written <= 0:
+            raise OSError(f"pwrite wrote nothing at offset {offset}")
+        view = view[written:]
+        offset += written
+
+async def _download_range(session, url, start, end, fd, progress):
+    """Download one byte range and write it at its offset in the file.
+    
+    A server may answer with less than the requested range, so the rest is
+    requested again until the whole range has been written. A dropped
+    connection resumes from the last received byte.
+    """
+    offset = start
+    attempt = 0
+    pending = []
+    pending_size = 0
+    
+    async def flush():
+        # Write the batch in a worker thread, it ends at the current offset
+        nonlocal pending_size
+        if pending:
+            write = asyncio.ensure_future(
+                asyncio.to_thread(_pwrite_all, fd, b''.join(pending), offset - pending_size)
+            )
+            try:
+                await asyncio.shield(write)
+            except asyncio.CancelledError:
+                # The fd is closed once we return, don't leave the thread writing to it
+                await write
+                raise
+            pending.clear()
+            pending_size = 0
+    
+    while offset <= end:
+        received = offset
+        try:
+            async with session.get(url, headers={"Range": f"bytes={offset}-{end}"}) as response:
+                if response.status != 206:
+                    raise RuntimeError(f"Range request returned status {response.status}")
+                
+                # Content-Range looks like "bytes 100-199/12345"
+                content_range = response.headers.get('content-range', '')
+                if not content_range.startswith(f"bytes {offset}-"):
+                    raise RuntimeError(f"Unexpected Content-Range {content_range!r} for bytes {offset}-{end}")
+                
+                async for chunk in response.content.iter_any():
+                    if offset + len(chunk) > end + 1:
+                        chunk = chunk[:end + 1 - offset]
+                    pending.append(chunk)
+                    pending_size += len(chunk)
+                    offset += len(chunk)
+                    progress[0] += len(chunk)
+                    if pending_size >= WRITE_BATCH_SIZE:
+                        await flush()
+                    if offset > end:
+                        break
+            await flush()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if attempt == DOWNLOAD_RETRIES:
+                raise
+            # Keep what arrived before the connection dropped
+            await flush()
+            logger.warning(f"Range {start}-{end} interrupted at {offset}, resuming: {str(e)}")
+            await asyncio.sleep(2 ** attempt)
+            attempt += 1
+            continue
+        
+        if offset == received:
+            raise RuntimeError(f"Range request for bytes {offset}-{end} returned no data")
+
+async def watch_progress(processing_msg, filename, progress, total_size):
+    """Periodically report the progress of a parallel download."""
+    while True:
+        await asyncio.sleep(PROGRESS_INTERVAL)
+        await edit_progress(processing_msg, filename, progress[0], total_size)
+
+async def download_in_ranges(session, url, total_size, processing_msg, filename):
+    """Download the file as parallel byte ranges into a temp file and return its path."""
+    segment = -(-total_size // RANGE_SEGMENTS)
+    ranges = [(start, min(start + segment, total_size) - 1) for start in range(0, total_size, segment)]
+    progress = [0]
+    
+    fd, temp_path = tempfile.mkstemp(suffix=os.path.splitext(filename)[1], dir=DOWNLOAD_PATH)
+    try:
+        # Reserve the disk space up front so a full disk fails before downloading
+        # (allocating gigabytes can take a while, keep it off the event loop)
+        if hasattr(os, 'posix_fallocate'):
+            await asyncio.to_thread(os.posix_fallocate, fd, 0, total_size)
+        else:
+            os.ftruncate(fd, total_size)
+        
+        watcher = asyncio.create_task(watch_progress(processing_msg, filename, progress, total_size))
+        tasks = [
+            asyncio.ensure_future(_download_range(session, url, start, end, fd, progress))
+            for start, end in ranges
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            # One range failed, stop the others before the file is closed
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        finally:
+            watcher.cancel()
+    except BaseException:
+        # Don't leave a partial (full-size, preallocated) temp file behind
+        os.close(fd)
+        os.unlink(temp_path)
+        raise
+    
+    os.close(fd)
+    return temp_path
+
+async def progress_writer(processing_msg, filename, queue):
+    """Edit the processing message for each (downloaded, total_size) put on the queue."""
+    while True:
+        downloaded, total_size = await queue.get()
+        try:
+            await edit_progress(processing_msg, filename, downloaded, total_size)
+        finally:
+            queue.task_done()
+
+async def iter_with_progress(response, processing_msg, filename, total_size, downloaded=0):
+    """Yield response chunks while reporting download progress.
+    
+    downloaded is the number of bytes already fetched before this response.
+    """
+    # Progress edits run in a background writer so they never stall the download
+    loop = asyncio.get_running_loop()
+    last_edit = 0.0
+    last_pct = -1
+    inv_total = (100.0 / total_size) if total_size else 0.0
+    queue = asyncio.Queue(maxsize=1)
+    writer = asyncio.create_task(progress_writer(processing_msg, filename, queue))
+    
+    try:
+        async for chunk in response.content.iter_any():
+            yield chunk
+            downloaded += len(chunk)
+            
+            # Update progress at most every few seconds, once the percentage moves
+            if total_size > 0:
+                now = loop.time()
+                pct = int(downloaded * inv_total)
+                if now - last_edit >= PROGRESS_INTERVAL and pct != last_pct:
+                    try:
+                        queue.put_nowait((downloaded, total_size))
+                    except asyncio.QueueFull:
+                        # Previous edit still pending, skip this one
+                        continue
+                    last_edit = now
+                    last_pct = pct
+        
+        # Don't let a late progress edit overwrite the next status message
+        await queue.join()
+    finally:
+        writer.cancel()
+
+async def download_stream(session, url, processing_msg, filename):
+    """Download the file as a single stream, resuming it if the connection drops.
+    
+    Small files are kept in memory and returned as bytes, larger ones are
+    written to a temp file and its path is returned. Returns None on failure.
+    """
+    data = None
+    f = None
+    total_size = 0
+    downloaded = 0
+    pending = []
+    pending_size = 0
+    append = pending.append
+    
+    try:
+        for attempt in range(DOWNLOAD_RETRIES + 1):
+            # After an interruption only ask for the bytes we don't have yet
+            headers = {"Range": f"bytes={downloaded}-"} if downloaded else None
+            try:
+                async with session.get(url, headers=headers) as response:
+                    if response.status == 206 and downloaded:
+                        # Only append the reply if it continues where we stopped
+                        content_range = response.headers.get('content-range', '')
+                        if not content_range.startswith(f"bytes {downloaded}-"):
+                            logger.warning(
+                                f"Resume at {downloaded} got Content-Range {content_range!r}, restarting"
+                            )
+                            downloaded = 0
+                            continue
+                    elif response.status == 200:
+                        # Full body: first attempt, or the server ignored the Range header
+                        downloaded = 0
+                        pending.clear()
+                        pending_size = 0
+                        total_size = response.content_length or 0
+                        if too_large_to_send(total_size):
+                            raise FileTooLarge(total_size)
+                        
+                        if data is not None:
+                            data.clear()
+                        elif f is not None:
+                            await f.seek(0)
+                            await f.truncate()
+                        elif 0 < total_size <= MAX_MEMORY_DOWNLOAD and not LOCAL_BOT_API_URL:
+                            # Files Telegram accepts as a normal upload never need to touch the disk
+                            data = bytearray()
+                        else:
+                            f = await aiofiles.tempfile.NamedTemporaryFile(
+                                'wb', delete=False, suffix=os.path.splitext(filename)[1], dir=DOWNLOAD_PATH
+                            )
+                    else:
+                        return None
+                    
+                    # Download with progress, handing chunks to the writer thread in batches
+                    async for chunk in iter_with_progress(
+                        response, processing_msg, filename, total_size, downloaded
+                    ):
+                        downloaded += len(chunk)
+                        # Catches bodies without a Content-Length too
+                        if too_large_to_send(downloaded):
+                            raise FileTooLarge(downloaded)
+                        if data is not None:
+                            data += chunk
+                            continue
+                        
+                        append(chunk)
+                        pending_size += len(chunk)
+                        if pending_size >= WRITE_BATCH_SIZE:
+                            await f.writelines(pending)
+                            pending.clear()
+                            pending_size = 0
+                break
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt == DOWNLOAD_RETRIES:
+                    raise
+                logger.warning(f"Download interrupted at {downloaded} bytes, resuming: {str(e)}")
+                await asyncio.sleep(2 ** attempt)
+        
+        if data is not None:
+            return bytes(data)
+        
+        if pending:
+            await f.writelines(pending)
+        temp_path = f.name
+        await f.close()
+        f = None
+        return temp_path
+    finally:
+        # Don't leave a partial temp file behind when the download failed
+        if f is not None:
+            await f.close()
+            os.unlink(f.name)
 
 async def start_download(update: Update, processing_msg, download_info, filename):
-    """Start downloading the file."""
+    """Start downloading the file.
+    
+    Returns True once the file was downloaded, False if the download failed
+    and None if the file was refused as too large.
+    """
     try:
         # Update message
-        await processing_msg.edit_text(
+        await safe_edit(
+            processing_msg,
             f"⬇️ <b>Downloading file...</b>\n\n"
             f"📁 <b>File:</b> <code>{filename}</code>\n"
             f"⏳ <b>Status:</b> Starting download...",
             parse_mode=ParseMode.HTML
         )
         
-        # Create temp file
-        with tempfile.NamedTemporaryFile(delete=False, suffix=f"_{filename}") as temp_file:
-            temp_path = temp_file.name
-        
         # Download the file
         download_url = download_info['url']
         
-        # Use aiohttp for async download
-        async with aiohttp.ClientSession() as session:
-            async with session.get(download_url) as response:
-                if response.status == 200:
-                    total_size = 0
-                    downloaded = 0
-                    
-                    # Get file size
-                    if 'content-length' in response.headers:
-                        total_size = int(response.headers['content-length'])
-                    
-                    # Download with progress
-                    async with aiofiles.open(temp_path, 'wb') as f:
-                        async for chunk in response.content.iter_chunked(8192):
-                            await f.write(chunk)
-                            downloaded += len(chunk)
-                            
-                            # Update progress every 1MB
-                            if total_size > 0 and downloaded % (1024 * 1024) < 8192:
-                                progress = (downloaded / total_size) * 100
-                                try:
-                                    await processing_msg.edit_text(
-                                        f"⬇️ <b>Downloading file...</b>\n\n"
-                                        f"📁 <b>File:</b> <code>{filename}</code>\n"
-                                        f"📊 <b>Progress:</b> {progress:.1f}%\n"
-                                        f"⏳ <b>Downloaded:</b> {downloaded / (1024*1024):.1f} MB",
-                                        parse_mode=ParseMode.HTML
-                                    )
-                                except:
-                                    pass
-                    
-                    # Send file to user
-                    await send_file_to_user(update, processing_msg, temp_path, filename)
-                    
-                else:
-                    await processing_msg.edit_text(
-                        "❌ <b>Download failed!</b>\n\n"
-                        "Server returned error code. Please try again later.",
-                        parse_mode=ParseMode.HTML
-                    )
+        # Use the shared aiohttp session for async download
+        session = SESSION
+        
+        # Fetch large files in parallel ranges when the server supports it.
+        # Skip the probe round trip when the page already says the file is small.
+        known_size = download_info.get('size')
+        is_small = isinstance(known_size, int) and 0 < known_size < MIN_RANGE_SIZE
+        if isinstance(known_size, int) and too_large_to_send(known_size):
+            raise FileTooLarge(known_size)
+        range_size = 0
+        if hasattr(os, 'pwrite') and not is_small:
+            try:
+                range_size = await probe_range_support(session, download_url)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                # The single stream retries on its own, let it have a go
+                logger.warning(f"Range probe failed, using a single stream: {str(e)}")
+        
+        if too_large_to_send(range_size):
+            raise FileTooLarge(range_size)
+        
+        if range_size >= MIN_RANGE_SIZE:
+            file = await download_in_ranges(session, download_url, range_size, processing_msg, filename)
+        else:
+            file = await download_stream(session, download_url, processing_msg, filename)
+        
+        if file is None:
+            await safe_edit(
+                processing_msg,
+                "❌ <b>Download failed!</b>\n\n"
+                "Server returned error code. Please try again later.",
+                parse_mode=ParseMode.HTML
+            )
+            return False
         
-        # Clean up temp file
         try:
-            os.unlink(temp_path)
-        except:
-            pass
+            # Send file to user
+            await send_file_to_user(update, processing_msg, file, filename)
+        except TelegramError as e:
+            # The download worked, so this isn't a dead link
+            logger.error(f"Could not send file: {str(e)}")
+        finally:
+            # Clean up temp file (its cached pages are freed with it)
+            if isinstance(file, str):
+                try:
+                    Path(file).unlink(missing_ok=True)
+                except OSError as e:
+                    logger.warning(f"Could not remove temp file {file}: {str(e)}")
         
+        return True
+        
+    except FileTooLarge as e:
+        # Refused before downloading it; the link itself is fine
+        await show_too_large(processing_msg, filename, e.size)
+        return None
     except Exception as e:
         logger.error(f"Download error: {str(e)}")
-        await processing_msg.edit_text(
+        await safe_edit(
+            processing_msg,
             f"❌ <b>Download failed!</b>\n\n"
             f"Error: {str(e)[:100]}\n\n"
             f"Please try again or use manual method.",
             parse_mode=ParseMode.HTML
         )
+        return False
+
+async def _send_photo(update: Update, file, filename):
+    """Send the file as a photo."""
+    await update.message.reply_photo(
+        photo=file,
+        filename=filename,
+        caption=f"📷 <b>Downloaded:</b> <code>{filename}</code>",
+        parse_mode=ParseMode.HTML
+    )
+
+async def _send_video(update: Update, file, filename):
+    """Send the file as a video."""
+    await update.message.reply_video(
+        video=file,
+        filename=filename,
+        caption=f"🎥 <b>Downloaded:</b> <code>{filename}</code>",
+        parse_mode=ParseMode.HTML,
+        supports_streaming=True
+    )
+
+async def _send_audio(update: Update, file, filename):
+    """Send the file as audio."""
+    await update.message.reply_audio(
+        audio=file,
+        filename=filename,
+        caption=f"🎵 <b>Downloaded:</b> <code>{filename}</code>",
+        parse_mode=ParseMode.HTML
+    )
+
+async def _send_document(update: Update, file, filename):
+    """Send the file as a document."""
+    await update.message.reply_document(
+        document=file,
+        filename=filename,
+        caption=f"📁 <b>Downloaded:</b> <code>{filename}</code>",
+        parse_mode=ParseMode.HTML
+    )
+
+# Media types Telegram shows inline
+_PHOTO_EXT = frozenset({'.jpg', '.jpeg', '.png', '.gif'})
+_VIDEO_EXT = frozenset({'.mp4', '.avi', '.mov', '.mkv'})
+_AUDIO_EXT = frozenset({'.mp3', '.wav', '.flac'})
+
+# File extension -> send method (anything else goes as a document)
+SENDERS = {
+    **dict.fromkeys(_PHOTO_EXT, _send_photo),
+    **dict.fromkeys(_VIDEO_EXT, _send_video),
+    **dict.fromkeys(_AUDIO_EXT, _send_audio),
+}
 
-async def send_file_to_user(update: Update, processing_msg, file_path, filename):
-    """Send downloaded file to user."""
+async def show_too_large(processing_msg, filename, file_size):
+    """Tell the user the file is over the bot upload limit."""
+    await safe_edit(
+        processing_msg,
+        f"⚠️ <b>File too large for Telegram!</b>\n\n"
+        f"📁 <b>File:</b> <code>{filename}</code>\n"
+        f"📊 <b>Size:</b> {file_size / (1024*1024):.1f} MB\n"
+        f"Bots can only upload files up to {CLOUD_UPLOAD_LIMIT // (1024*1024)} MB.",
+        parse_mode=ParseMode.HTML
+    )
+
+async def send_file_to_user(update: Update, processing_msg, file, filename):
+    """Send downloaded file (a path or the file content) to user."""
     try:
-        file_size = os.path.getsize(file_path)
+        if isinstance(file, bytes):
+            file_size = len(file)
+        else:
+            file_size = os.path.getsize(file)
+        
+        # The cloud Bot API rejects bigger uploads, don't read the file just to fail
+        if too_large_to_send(file_size):
+            await show_too_large(processing_msg, filename, file_size)
+            return
         
         # Determine file type
         ext = os.path.splitext(filename)[1].lower()
         
         # Update message
-        await processing_msg.edit_text(
+        await safe_edit(
+            processing_msg,
             f"📤 <b>Sending file to you...</b>\n\n"
             f"📁 <b>File:</b> <code>{filename}</code>\n"
             f"📊 <b>Size:</b> {file_size / (1024*1024):.1f} MB\n"
@@ -217,36 +806,19 @@ async def send_file_to_user(update: Update, processing_msg, file_path, filename)
             parse_mode=ParseMode.HTML
         )
         
-        # Send file based on type
-        with open(file_path, 'rb') as file:
-            if ext in ['.jpg', '.jpeg', '.png', '.gif']:
-                await update.message.reply_photo(
-                    photo=file,
-                    caption=f"📷 <b>Downloaded:</b> <code>{filename}</code>",
-                    parse_mode=ParseMode.HTML
-                )
-            elif ext in ['.mp4', '.avi', '.mov', '.mkv']:
-                await update.message.reply_video(
-                    video=file,
-                    caption=f"🎥 <b>Downloaded:</b> <code>{filename}</code>",
-                    parse_mode=ParseMode.HTML,
-                    supports_streaming=True
-                )
-            elif ext in ['.mp3', '.wav', '.flac']:
-                await update.message.reply_audio(
-                    audio=file,
-                    caption=f"🎵 <b>Downloaded:</b> <code>{filename}</code>",
-                    parse_mode=ParseMode.HTML
-                )
+        # Send file based on type; a local Bot API server reads the path itself
+        if not isinstance(file, bytes):
+            if LOCAL_BOT_API_URL:
+                file = Path(file)
             else:
-                await update.message.reply_document(
-                    document=file,
-                    caption=f"📁 <b>Downloaded:</b> <code>{filename}</code>",
-                    parse_mode=ParseMode.HTML
-                )
+                # PTB would read the whole file on the event loop, do it in a thread
+                file = await asyncio.to_thread(Path(file).read_bytes)
+        sender = SENDERS.get(ext, _send_document)
+        await sender(update, file, filename)
         
         # Success message
-        await processing_msg.edit_text(
+        await safe_edit(
+            processing_msg,
             f"✅ <b>File sent successfully!</b>\n\n"
             f"📁 <b>File:</b> <code>{filename}</code>\n"
             f"📊 <b>Size:</b> {file_size / (1024*1024):.1f} MB\n"
@@ -256,10 +828,10 @@ async def send_file_to_user(update: Update, processing_msg, file_path, filename)
         
     except Exception as e:
         logger.error(f"Error sending file: {str(e)}")
-        await processing_msg.edit_text(
+        await safe_edit(
+            processing_msg,
             f"⚠️ <b>File too large for Telegram!</b>\n\n"
-            f"Telegram has file size limits.\n"
-            f"File saved at: <code>{file_path}</code>",
+            f"Telegram has file size limits.",
             parse_mode=ParseMode.HTML
         )
 
@@ -285,7 +857,7 @@ async def show_manual_method(update: Update, processing_msg, url, filename, file
 🔄 You can try sending the link again in a few minutes.
     """
     
-    await processing_msg.edit_text(manual_text, parse_mode=ParseMode.HTML)
+    await safe_edit(processing_msg, manual_text, parse_mode=ParseMode.HTML)
 
 async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Check bot status."""
@@ -298,10 +870,66 @@ async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         parse_mode=ParseMode.HTML
     )
 
+async def post_init(application: Application):
+    """Create the shared HTTP session once the event loop is running."""
+    global SESSION
+    os.makedirs(DOWNLOAD_PATH, exist_ok=True)
+    connector = aiohttp.TCPConnector(
+        limit=64,
+        limit_per_host=8,
+        ttl_dns_cache=300,
+        # Keep idle CDN connections around between downloads
+        keepalive_timeout=75,
+        ssl=_SSL_CTX
+    )
+    SESSION = aiohttp.ClientSession(
+        connector=connector,
+        # No total limit so multi-GB files can finish; stalled sockets still time out
+        timeout=aiohttp.ClientTimeout(total=None, sock_connect=15, sock_read=120)
+    )
+
+async def post_shutdown(application: Application):
+    """Close the shared HTTP session."""
+    if SESSION is not None:
+        await SESSION.close()
+    LOOKUP_EXECUTOR.shutdown(wait=False, cancel_futures=True)
+
 def main():
     """Start the bot."""
+    # Use the faster libuv event loop where available (not on Windows)
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
+    
     # Create application
-    application = Application.builder().token(BOT_TOKEN).build()
+    builder = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        # Handle updates concurrently so one long download doesn't block other chats
+        .concurrent_updates(True)
+        # Stay under Telegram's flood limits (30 msg/s overall, 20 msg/min per group)
+        .rate_limiter(AIORateLimiter(
+            overall_max_rate=28,
+            overall_time_period=1,
+            group_max_rate=18,
+            group_time_period=60
+        ))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    
+    # A local Bot API server reads files straight from disk instead of an upload
+    if LOCAL_BOT_API_URL:
+        builder = (
+            builder
+            .base_url(f"{LOCAL_BOT_API_URL}/bot")
+            .base_file_url(f"{LOCAL_BOT_API_URL}/file/bot")
+            .local_mode(True)
+        )
+    
+    application = builder.build()
     
     # Add command handlers
     application.add_handler(CommandHandler("start", start))
@@ -4,15 +4,20 @@ from dotenv import load_dotenv
 load_dotenv()
 
 # Bot configuration
-BOT_TOKEN = "8546123786:AAFHdnlAYk2qu8lIr--yXmdJlELDWOQ-KRM"  # Your token
+BOT_TOKEN = os.getenv("BOT_TOKEN", "")
+if not BOT_TOKEN:
+    raise RuntimeError("BOT_TOKEN is not set; add it to the environment or .env")
 ADMIN_IDS = [int(id.strip()) for id in os.getenv("ADMIN_IDS", "").split(",") if id.strip()]
 
 # Download settings
 DOWNLOAD_PATH = os.getenv("DOWNLOAD_PATH", "./downloads")
 MAX_FILE_SIZE = int(os.getenv("MAX_FILE_SIZE", "2147483648"))  # 2GB
 
+# Local Bot API server (e.g. http://localhost:8081), uploads by file path
+LOCAL_BOT_API_URL = os.getenv("LOCAL_BOT_API_URL", "").rstrip("/")
+
 # Allowed extensions
-ALLOWED_EXTENSIONS = [
+ALLOWED_EXTENSIONS = frozenset({
     # Videos
     '.mp4', '.avi', '.mkv', '.mov', '.wmv', '.flv', '.webm', '.m4v',
     # Audio
@@ -25,8 +30,15 @@ ALLOWED_EXTENSIONS = [
     '.zip', '.rar', '.7z', '.tar', '.gz', '.bz2',
     # Others
     '.apk', '.exe', '.iso', '.torrent'
-]
+})
 
 # Rate limiting (per user)
 MAX_DOWNLOADS_PER_DAY = 10
-DOWNLOAD_COOLDOWN = 60  # seconds between downloads
\ No newline at end of file
+DOWNLOAD_COOLDOWN = 60  # seconds the burst limit applies to
+DOWNLOAD_BURST = 5  # downloads allowed per DOWNLOAD_COOLDOWN
+
+# Downloads running at the same time (all users)
+MAX_CONCURRENT_DOWNLOADS = int(os.getenv("MAX_CONCURRENT_DOWNLOADS", "4"))
+
+# Link page lookups running at the same time (all users)
+MAX_CONCURRENT_LOOKUPS = int(os.getenv("MAX_CONCURRENT_LOOKUPS", "4"))
\ No newline at end of file
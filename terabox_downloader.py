@@ -1,30 +1,111 @@
 import requests
 import re
-import json
+import shutil
+import threading
 import time
 import logging
-from urllib.parse import unquote, urlparse
-import cloudscraper
+from types import MappingProxyType
+from urllib.parse import unquote, urlsplit
+
+# orjson parses page data several times faster; fall back to the stdlib
+try:
+    import orjson as json
+except ImportError:
+    import json
 
 logger = logging.getLogger(__name__)
 
+# Terabox domains (also matches 1024terabox.com and www. hosts)
+_TERABOX_RE = re.compile(r'terabox\.(?:com|app)|dubox\.com', re.IGNORECASE)
+
+# Page patterns used by extract_info, compiled once at import
+_META_RE = re.compile(r'<meta\s+property="og:(title|url|type)"\s+content="([^"]+)"', re.IGNORECASE)
+_META_KEYS = {'title': 'filename', 'url': 'url', 'type': 'type'}
+_VIDEO_RE = re.compile(r'<video[^>]+src="([^"]+)"', re.IGNORECASE)
+_DOWNLOAD_BTN_RE = re.compile(r'<a[^>]+href="([^"]+)"[^>]*download[^>]*>', re.IGNORECASE)
+_TITLE_RE = re.compile(r'<title>([^<]+)</title>', re.IGNORECASE)
+
+# Browser-like headers sent with every request (read-only, shared by all instances)
+_DEFAULT_HEADERS = MappingProxyType({
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.5',
+    'Accept-Encoding': 'gzip, deflate, br',
+    'DNT': '1',
+    'Connection': 'keep-alive',
+    'Upgrade-Insecure-Requests': '1',
+    'Sec-Fetch-Dest': 'document',
+    'Sec-Fetch-Mode': 'navigate',
+    'Sec-Fetch-Site': 'none',
+    'Sec-Fetch-User': '?1',
+})
+
+# Start of the `window.data = {` assignment (not window.dataLayer etc.)
+_WINDOW_DATA_START_RE = re.compile(r'window\.data\s*=\s*\{')
+
+# Braces and (possibly unterminated) string literals, for _extract_window_data
+_JSON_TOKEN_RE = re.compile(r'[{}]|"[^"\\]*(?:\\.[^"\\]*)*"?', re.DOTALL)
+
+# Share page data sits near the top; only read past this much if needed
+_PAGE_PREFIX_SIZE = 256 * 1024
+
+def _extract_window_data(html):
+    """Return the `window.data = {...}` object literal from html, or None.
+
+    Braces are counted in one forward scan. The tokenizer jumps over plain
+    text and whole string literals in C, so Python only visits braces and
+    strings, never single characters.
+    """
+    match = _WINDOW_DATA_START_RE.search(html)
+    if match is None:
+        return None
+    i = match.end() - 1
+    # The literal can't run past its closing script tag
+    end = html.find('</script>', i)
+    if end < 0:
+        end = len(html)
+    depth = 0
+    for match in _JSON_TOKEN_RE.finditer(html, i, end):
+        token = match.group()
+        if token == '{':
+            depth += 1
+        elif token == '}':
+            depth -= 1
+            if depth == 0:
+                return html[i:match.end()]
+    return None
+
 class TeraboxDownloader:
     def __init__(self):
+        # The scraper is created on first use, see the scraper property
+        self._scraper = None
+        self._scraper_lock = threading.Lock()
+    
+    @property
+    def scraper(self):
+        """The cloudscraper session, created the first time it is needed"""
+        if self._scraper is None:
+            with self._scraper_lock:
+                if self._scraper is None:
+                    self._scraper = self._create_scraper()
+        return self._scraper
+    
+    def _create_scraper(self):
         # Use cloudscraper to bypass Cloudflare
-        self.scraper = cloudscraper.create_scraper()
-        self.scraper.headers.update({
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-            'Accept-Language': 'en-US,en;q=0.5',
-            'Accept-Encoding': 'gzip, deflate, br',
-            'DNT': '1',
-            'Connection': 'keep-alive',
-            'Upgrade-Insecure-Requests': '1',
-            'Sec-Fetch-Dest': 'document',
-            'Sec-Fetch-Mode': 'navigate',
-            'Sec-Fetch-Site': 'none',
-            'Sec-Fetch-User': '?1',
-        })
+        import cloudscraper
+        
+        scraper = cloudscraper.create_scraper()
+        scraper.headers.update(_DEFAULT_HEADERS)
+        # Re-mount the TLS adapter with a larger keep-alive pool so
+        # concurrent extractions reuse connections instead of handshaking
+        adapter = scraper.get_adapter('https://')
+        scraper.mount('https://', cloudscraper.CipherSuiteAdapter(
+            ssl_context=adapter.ssl_context,
+            source_address=adapter.source_address,
+            pool_connections=4,
+            pool_maxsize=32,
+        ))
+        return scraper
     
     def extract_info(self, url):
         """Extract file information from Terabox URL"""
@@ -35,91 +116,106 @@ class TeraboxDownloader:
             if '1024terabox.com' in url:
                 url = url.replace('1024terabox.com', 'terabox.com')
             
-            # Fetch the page
-            response = self.scraper.get(url, timeout=30)
-            
-            if response.status_code != 200:
-                logger.error(f"Failed to fetch page: {response.status_code}")
-                return None
-            
-            html = response.text
-            
-            # Method 1: Try to find JSON data
-            json_pattern = r'window\.data\s*=\s*({.*?});'
-            match = re.search(json_pattern, html, re.DOTALL)
-            
-            if match:
-                try:
-                    data = json.loads(match.group(1))
-                    if 'file' in data and 'filename' in data['file']:
-                        return {
-                            'filename': unquote(data['file']['filename']),
-                            'size': data['file'].get('size', 0),
-                            'direct_url': data['file'].get('download_url')
-                        }
-                except:
-                    pass
-            
-            # Method 2: Try to find meta tags
-            meta_patterns = {
-                'filename': r'<meta\s+property="og:title"\s+content="([^"]+)"',
-                'url': r'<meta\s+property="og:url"\s+content="([^"]+)"',
-                'type': r'<meta\s+property="og:type"\s+content="([^"]+)"',
-            }
-            
-            info = {}
-            for key, pattern in meta_patterns.items():
-                match = re.search(pattern, html, re.IGNORECASE)
-                if match:
-                    info[key] = unquote(match.group(1))
-            
-            # Method 3: Look for video tags
-            video_pattern = r'<video[^>]+src="([^"]+)"'
-            match = re.search(video_pattern, html, re.IGNORECASE)
-            if match:
-                info['direct_url'] = match.group(1)
-            
-            # Method 4: Look for download button
-            download_pattern = r'<a[^>]+href="([^"]+)"[^>]*download[^>]*>'
-            match = re.search(download_pattern, html, re.IGNORECASE)
-            if match:
-                info['direct_url'] = match.group(1)
-            
-            # If we have some info, return it
-            if info:
-                if 'filename' not in info:
-                    # Extract filename from URL
-                    parsed = urlparse(url)
-                    path = parsed.path
-                    if '/' in path:
-                        filename = path.split('/')[-1]
-                        if filename:
-                            info['filename'] = unquote(filename)
+            # Fetch the page, reading only its head at first
+            response = self.scraper.get(url, timeout=30, stream=True)
+            try:
+                if response.status_code != 200:
+                    logger.error(f"Failed to fetch page: {response.status_code}")
+                    return None
+                
+                # Share pages are UTF-8; don't trust a missing charset
+                # (requests would fall back to ISO-8859-1)
+                body = response.raw.read(_PAGE_PREFIX_SIZE, decode_content=True)
+                info, final = self._parse_page(body.decode('utf-8', errors='replace'), url)
+                
+                # Anything but a window.data hit could still be overridden
+                # by something further down the page
+                if len(body) >= _PAGE_PREFIX_SIZE and not final:
+                    body += response.raw.read(decode_content=True)
+                    info, final = self._parse_page(body.decode('utf-8', errors='replace'), url)
                 
                 return info
-            
-            # Method 5: Try to find title
-            title_pattern = r'<title>([^<]+)</title>'
-            match = re.search(title_pattern, html, re.IGNORECASE)
-            if match:
-                title = match.group(1).strip()
-                if ' - ' in title:
-                    filename = title.split(' - ')[0].strip()
-                    return {
-                        'filename': filename,
-                        'source': 'title'
-                    }
-            
-            return None
+            finally:
+                response.close()
             
         except Exception as e:
             logger.error(f"Error extracting info: {str(e)}")
             return None
     
-    def get_direct_download(self, url):
-        """Get direct download link using alternative methods"""
+    def _parse_page(self, html, url):
+        """Pull file information out of a share page's HTML
+        
+        Returns (info, final); final is True when the info came from
+        window.data, which takes precedence over everything else on the page.
+        """
+        # Method 1: Try to find JSON data
+        window_data = _extract_window_data(html)
+        
+        if window_data:
+            try:
+                data = json.loads(window_data)
+                if 'file' in data and 'filename' in data['file']:
+                    return {
+                        'filename': unquote(data['file']['filename']),
+                        'size': data['file'].get('size', 0),
+                        'direct_url': data['file'].get('download_url')
+                    }, True
+            except:
+                pass
+        
+        # Method 2: Try to find meta tags (one pass for all og: fields)
+        info = {}
+        for match in _META_RE.finditer(html):
+            key = _META_KEYS[match.group(1).lower()]
+            if key not in info:
+                info[key] = unquote(match.group(2))
+                if len(info) == len(_META_KEYS):
+                    break
+        
+        # Method 3: Look for video tags
+        match = _VIDEO_RE.search(html)
+        if match:
+            info['direct_url'] = match.group(1)
+        
+        # Method 4: Look for download button
+        match = _DOWNLOAD_BTN_RE.search(html)
+        if match:
+            info['direct_url'] = match.group(1)
+        
+        # If we have some info, return it
+        if info:
+            if 'filename' not in info:
+                # Extract filename from URL
+                parsed = urlsplit(url)
+                path = parsed.path
+                if '/' in path:
+                    filename = path.split('/')[-1]
+                    if filename:
+                        info['filename'] = unquote(filename)
+            
+            return info, False
+        
+        # Method 5: Try to find title
+        match = _TITLE_RE.search(html)
+        if match:
+            title = match.group(1).strip()
+            if ' - ' in title:
+                filename = title.split(' - ')[0].strip()
+                return {
+                    'filename': filename,
+                    'source': 'title'
+                }, False
+        
+        return None, False
+    
+    def get_direct_download(self, url, info=None):
+        """Get direct download link using alternative methods
+        
+        Pass the result of extract_info() as info to avoid fetching the page again.
+        """
         try:
-            info = self.extract_info(url)
+            if info is None:
+                info = self.extract_info(url)
             if not info:
                 return None
             
@@ -127,7 +223,8 @@ class TeraboxDownloader:
             if 'direct_url' in info:
                 return {
                     'filename': info.get('filename', f'file_{int(time.time())}'),
-                    'url': info['direct_url']
+                    'url': info['direct_url'],
+                    'size': info.get('size', 0)
                 }
             
             # Try to construct download URL from share URL
@@ -155,32 +252,31 @@ class TeraboxDownloader:
             logger.error(f"Error getting direct download: {str(e)}")
             return None
     
+    def share_key(self, url):
+        """Return the share ID of a /s/ link, so equivalent links map to one key"""
+        if '/s/' in url:
+            share_id = url.split('/s/', 1)[1].split('?')[0].split('/')[0]
+            if share_id:
+                return share_id
+        return url
+    
     def is_terabox_url(self, url):
         """Check if URL is from Terabox"""
-        terabox_domains = [
-            'terabox.com',
-            '1024terabox.com',
-            'terabox.app',
-            'www.terabox.com',
-            'dubox.com',
-            'www.dubox.com'
-        ]
-        return any(domain in url.lower() for domain in terabox_domains)
+        return _TERABOX_RE.search(url) is not None
     
     def download_file(self, url, save_path):
         """Download file directly"""
         try:
-            response = self.scraper.get(url, stream=True, timeout=60)
-            
-            if response.status_code == 200:
-                with open(save_path, 'wb') as f:
-                    for chunk in response.iter_content(chunk_size=8192):
-                        if chunk:
-                            f.write(chunk)
-                return True
-            else:
-                logger.error(f"Download failed: {response.status_code}")
-                return False
+            with self.scraper.get(url, stream=True, timeout=60) as response:
+                if response.status_code == 200:
+                    # Copy in 1 MiB blocks without a Python-level chunk loop
+                    response.raw.decode_content = True
+                    with open(save_path, 'wb') as f:
+                        shutil.copyfileobj(response.raw, f, 1024 * 1024)
+                    return True
+                else:
+                    logger.error(f"Download failed: {response.status_code}")
+                    return False
                 
         except Exception as e:
             logger.error(f"Download error: {str(e)}")